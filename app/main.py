@@ -1,41 +1,81 @@
 from fastapi import FastAPI
-from fastapi.websockets import WebSocket
+from fastapi.responses import ORJSONResponse
+from fastapi.websockets import WebSocket, WebSocketDisconnect
 import asyncio
-import json
+import logging
+import orjson
 
 # Import routers and services
-from app.routes import jobs
+from app.routes import jobs, scheduler
 from app.services.database import SessionLocal, init_db
+from app.services.job_events import job_events
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI(
     title="Task Queue System",
     description="A task queue system for handling background jobs.",
     version="1.0.0",
+    default_response_class=ORJSONResponse,
 )
 
 
 # Include routers
 app.include_router(jobs.router, prefix="", tags=["jobs"])
+app.include_router(scheduler.router, prefix="", tags=["scheduler"])
 
 
 @app.get("/")
 async def root():
     return {"message": "Welcome to the Task Queue System API. Check /docs for API documentation."}
 
-# Placeholder for WebSocket endpoint for real-time updates
+# WebSocket endpoint for real-time updates, fed by Postgres LISTEN/NOTIFY
+
+# Updates arriving within this window are sent together as one JSON array frame
+STREAM_BATCH_WINDOW_SECONDS = 0.01
+
+
+async def stream_job_events(websocket: WebSocket, queue: asyncio.Queue):
+    while True:
+        batch = [await queue.get()]
+        await asyncio.sleep(STREAM_BATCH_WINDOW_SECONDS)
+        while True:
+            try:
+                batch.append(queue.get_nowait())
+            except asyncio.QueueEmpty:
+                break
+        # Payloads are already JSON documents, so join them without re-encoding
+        await websocket.send_text("[" + ",".join(batch) + "]")
+
+
+async def receive_until_disconnect(websocket: WebSocket):
+    # Client messages are ignored; reading only notices the client going away
+    try:
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
 
 
 @app.websocket("/jobs/stream")
 async def websocket_endpoint(websocket: WebSocket):
     await websocket.accept()
+    await websocket.send_text(orjson.dumps({"status": "connected", "message": "Waiting for job updates..."}).decode())
+    queue = job_events.subscribe()
+    writer = asyncio.create_task(stream_job_events(websocket, queue))
+    reader = asyncio.create_task(receive_until_disconnect(websocket))
     try:
-        while True:
-            # Simulate sending updates (to be replaced with actual job status updates)
-            await websocket.send_text(json.dumps({"status": "connected", "message": "Waiting for job updates..."}))
-            await asyncio.sleep(10)
-    except Exception as e:
-        await websocket.close()
-        print(f"WebSocket error: {e}")
+        # The client leaving or a failed send ends the connection, whichever comes first
+        done, _ = await asyncio.wait({reader, writer}, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                logger.warning("WebSocket error: %s", task.exception())
+    finally:
+        job_events.unsubscribe(queue)
+        # Reap both tasks so neither leaves an unretrieved exception behind
+        reader.cancel()
+        writer.cancel()
+        await asyncio.gather(reader, writer, return_exceptions=True)
 
 # Add event handlers for startup and shutdown
 
@@ -44,13 +84,14 @@ async def websocket_endpoint(websocket: WebSocket):
 async def startup_db_client():
     # Initialize database by creating tables if they don't exist
     init_db()
+    job_events.start()
 
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
     # Close database connections or other cleanup tasks
-    pass
+    job_events.stop()
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    uvicorn.run(app, host="0.0.0.0", port=8000, loop="uvloop", http="httptools", ws="websockets")
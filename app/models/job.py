@@ -1,7 +1,8 @@
 from sqlalchemy import (
-    Column, Integer, String, Enum, JSON, DateTime,
-    ForeignKey, Table
+    Column, Integer, SmallInteger, String, Enum, JSON, DateTime,
+    ForeignKey, Table, Index, Sequence
 )
+from sqlalchemy.types import TypeDecorator
 from sqlalchemy.orm import declarative_base, relationship
 from pydantic import BaseModel, Field
 from typing import List, Dict, Optional
@@ -25,6 +26,16 @@ class JobPriority(str, enum.Enum):
     normal = "normal"
     low = "low"
 
+    @property
+    def rank(self) -> int:
+        """Scheduling order, most urgent first (critical=0 ... low=3)."""
+        return PRIORITY_RANKS[self]
+
+
+# Declaration order is scheduling order
+PRIORITY_RANKS = {priority: rank for rank, priority in enumerate(JobPriority)}
+PRIORITIES_BY_RANK = {rank: priority for priority, rank in PRIORITY_RANKS.items()}
+
 
 class JobStatus(str, enum.Enum):
     pending = "pending"
@@ -34,6 +45,22 @@ class JobStatus(str, enum.Enum):
     cancelled = "cancelled"
 
 
+# --- COLUMN TYPES ---
+class PriorityRank(TypeDecorator):
+    """
+    Stores a JobPriority as its SMALLINT rank, so ordering by priority is a
+    plain integer comparison the btree indexes can serve directly.
+    """
+    impl = SmallInteger
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        return None if value is None else JobPriority(value).rank
+
+    def process_result_value(self, value, dialect):
+        return None if value is None else PRIORITIES_BY_RANK[value]
+
+
 # --- ASSOCIATION TABLE (Many-to-Many for dependencies) ---
 job_dependencies = Table(
     "job_dependencies",
@@ -44,27 +71,36 @@ job_dependencies = Table(
 )
 
 
+# --- SEQUENCES ---
+# Monotonic enqueue counter backing Job.position_in_queue
+queue_position_seq = Sequence("jobs_queue_pos_seq", metadata=Base.metadata)
+
+
 # --- DATABASE MODELS ---
 class Job(Base):
     __tablename__ = "jobs"
 
     job_id = Column(String, primary_key=True, index=True)
     job_type = Column(Enum(JobType), nullable=False)
-    priority = Column(Enum(JobPriority), nullable=False,
-                      default=JobPriority.normal, index=True)
+    priority = Column(PriorityRank, nullable=False,
+                      default=JobPriority.normal)
     status = Column(Enum(JobStatus), nullable=False,
-                    default=JobStatus.pending, index=True)
+                    default=JobStatus.pending)
     payload = Column(JSON, nullable=False)
+    # SHA-256 of the canonical JSON payload, used for duplicate detection
+    payload_hash = Column(String(64), nullable=True)
     resource_requirements = Column(JSON, nullable=False)
     retry_config = Column(JSON, nullable=True)
     timeout_seconds = Column(Integer, nullable=True)
+    attempts = Column(Integer, nullable=False, default=0, server_default="0")
 
     created_at = Column(DateTime, nullable=False,
                         default=datetime.utcnow, index=True)
     updated_at = Column(DateTime, nullable=False,
                         default=datetime.utcnow, onupdate=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
-    position_in_queue = Column(Integer, nullable=True, index=True)
+    position_in_queue = Column(Integer, nullable=True, index=True,
+                               server_default=queue_position_seq.next_value())
 
     # Job dependencies (many-to-many self-referential)
     depends_on = relationship(
@@ -79,6 +115,18 @@ class Job(Base):
     logs = relationship("JobLog", back_populates="job")
 
 
+# --- INDEXES ---
+# Duplicate detection probes (job_type, status IN (...), payload_hash)
+Index("idx_jobs_dedupe", Job.job_type, Job.status, Job.payload_hash)
+# list_jobs: filter by status, page in (priority, created_at DESC) order.
+# Also covers lookups by status alone, so status/priority have no own index.
+Index("idx_jobs_listing", Job.status, Job.priority, Job.created_at.desc())
+# Worker dispatch: pending jobs in (priority, created_at) order. Partial, so
+# it only holds the queue itself rather than the whole job history.
+Index("ix_job_ready", Job.priority, Job.created_at,
+      postgresql_where=Job.status == JobStatus.pending)
+
+
 class JobLog(Base):
     __tablename__ = "job_logs"
 
@@ -92,6 +140,20 @@ class JobLog(Base):
     job = relationship("Job", back_populates="logs")
 
 
+class ResourcePool(Base):
+    """
+    Single-row ledger of shared CPU/memory capacity. Reservations are
+    conditional UPDATEs on this row, so every worker process sees one pool.
+    """
+    __tablename__ = "resource_pool"
+
+    id = Column(Integer, primary_key=True)
+    total_cpu_units = Column(Integer, nullable=False)
+    total_memory_mb = Column(Integer, nullable=False)
+    used_cpu_units = Column(Integer, nullable=False, default=0)
+    used_memory_mb = Column(Integer, nullable=False, default=0)
+
+
 # --- PYDANTIC MODELS (for API schema validation) ---
 class ResourceRequirements(BaseModel):
     cpu_units: int = Field(..., ge=1)
@@ -147,3 +209,23 @@ class JobLogResponse(BaseModel):
 
     class Config:
         orm_mode = True
+
+
+class PoolStats(BaseModel):
+    limit: int
+    running: int
+
+
+class GroupStats(BaseModel):
+    pool: str
+    limit: int
+    pending: int
+    running: int
+
+
+class SchedulerStatsResponse(BaseModel):
+    max_concurrency: int
+    pending: int
+    running: int
+    pools: Dict[str, PoolStats]
+    groups: Dict[JobType, GroupStats]
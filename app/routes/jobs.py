@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import orjson
 
 from app.models.job import (
-    JobCreate, JobResponse, JobDetailResponse, JobLogResponse, JobStatus
+    JobCreate, JobResponse, JobDetailResponse, JobLogResponse, JobStatus, JobPriority, JobType
 )
 from app.services import job_service
 from app.services.database import get_db
@@ -12,7 +14,7 @@ router = APIRouter()
 
 
 @router.post("/jobs", response_model=JobResponse, status_code=status.HTTP_201_CREATED)
-async def create_job(job: JobCreate, db: Session = Depends(get_db)):
+def create_job(job: JobCreate, db: Session = Depends(get_db)):
     """
     Submit a new job to the queue.
     """
@@ -25,21 +27,21 @@ async def create_job(job: JobCreate, db: Session = Depends(get_db)):
 
 
 @router.get("/jobs/{job_id}", response_model=JobDetailResponse)
-async def get_job(job_id: str, db: Session = Depends(get_db)):
+def get_job(job_id: str, db: Session = Depends(get_db)):
     """
     Get detailed information about a specific job.
     """
-    job = job_service.get_job(db, job_id)
+    job = job_service.get_job_detail(db, job_id)
     if not job:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
     return job
 
 
 @router.get("/jobs", response_model=List[JobResponse])
-async def list_jobs(
+def list_jobs(
     status: Optional[JobStatus] = None,
-    priority: Optional[str] = None,
-    type: Optional[str] = None,
+    priority: Optional[JobPriority] = None,
+    type: Optional[JobType] = None,
     skip: int = 0,
     limit: int = 100,
     db: Session = Depends(get_db)
@@ -58,7 +60,7 @@ async def list_jobs(
 
 
 @router.patch("/jobs/{job_id}/cancel", response_model=JobResponse)
-async def cancel_job(job_id: str, db: Session = Depends(get_db)):
+def cancel_job(job_id: str, db: Session = Depends(get_db)):
     """
     Cancel a job if it is in a pending or running state.
     """
@@ -73,12 +75,15 @@ async def cancel_job(job_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Error canceling job")
 
 
-@router.get("/jobs/{job_id}/logs", response_model=List[JobLogResponse])
-async def get_job_logs(job_id: str, db: Session = Depends(get_db)):
+@router.get("/jobs/{job_id}/logs", response_class=StreamingResponse)
+def get_job_logs(job_id: str, db: Session = Depends(get_db)):
     """
-    Get execution logs for a specific job.
+    Stream execution logs for a specific job as newline-delimited JSON (one JobLogResponse per line).
     """
     logs = job_service.get_job_logs(db, job_id)
     if logs is None:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
-    return logs
+    return StreamingResponse(
+        (orjson.dumps(JobLogResponse.from_orm(log).dict()) + b"\n" for log in logs),
+        media_type="application/x-ndjson"
+    )
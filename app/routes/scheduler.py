@@ -0,0 +1,16 @@
+from fastapi import APIRouter, Depends
+from sqlalchemy.orm import Session
+
+from app.models.job import SchedulerStatsResponse
+from app.services import scheduler
+from app.services.database import get_db
+
+router = APIRouter()
+
+
+@router.get("/scheduler/stats", response_model=SchedulerStatsResponse)
+def get_scheduler_stats(db: Session = Depends(get_db)):
+    """
+    Get pending/running job counts per job type and the configured concurrency limits.
+    """
+    return scheduler.get_stats(db)
@@ -1,14 +1,46 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker
-from app.models.job import Base
+from app.models.job import Base, PRIORITY_RANKS
 import logging
+import orjson
+import os
+import time
 
-DATABASE_URL = "postgresql://user:password@db:5432/taskqueue"
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://user:password@db:5432/taskqueue")
 
-
-engine = create_engine(DATABASE_URL, echo=True)
+# Fixed-size pool with no overflow: under load callers wait up to pool_timeout
+# for a free connection instead of opening more than Postgres will accept.
+engine = create_engine(
+    DATABASE_URL,
+    echo=os.getenv("SQL_ECHO") == "1",
+    pool_size=int(os.getenv("DB_POOL_SIZE", "20")),
+    max_overflow=0,
+    pool_timeout=30,
+    pool_pre_ping=True,
+    # Room for every distinct statement shape so none is recompiled after warm-up
+    query_cache_size=1200,
+    # payload/resource_requirements/retry_config go through orjson instead of stdlib json
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 logging.getLogger('sqlalchemy.engine').setLevel(logging.WARN)
+logger = logging.getLogger(__name__)
+
+# Instead of echoing every statement, only log the ones slower than this
+SLOW_QUERY_THRESHOLD_SECONDS = float(os.getenv("SLOW_QUERY_THRESHOLD_MS", "50")) / 1000
+
+
+@event.listens_for(engine, "before_cursor_execute")
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context._query_started_at = time.perf_counter()
+
+
+@event.listens_for(engine, "after_cursor_execute")
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._query_started_at
+    if elapsed > SLOW_QUERY_THRESHOLD_SECONDS:
+        logger.warning("Slow query (%.1f ms): %s", elapsed * 1000, statement)
 
 
 def get_db():
@@ -19,6 +51,64 @@ def get_db():
         db.close()
 
 
+# Publish a compact JSON summary of every job insert/update on jobs_channel.
+# The full row is not sent: NOTIFY payloads are capped at 8000 bytes.
+JOBS_NOTIFY_DDL = """
+CREATE OR REPLACE FUNCTION notify_job_change() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify('jobs_channel', json_build_object(
+        'job_id', NEW.job_id,
+        'type', NEW.job_type,
+        'status', NEW.status,
+        'updated_at', NEW.updated_at
+    )::text);
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS jobs_notify ON jobs;
+CREATE TRIGGER jobs_notify AFTER INSERT OR UPDATE ON jobs
+    FOR EACH ROW EXECUTE PROCEDURE notify_job_change();
+"""
+
+
+# Bring a jobs table created by an earlier version up to the current model.
+# create_all only creates missing tables, so new columns, the SMALLINT
+# priority and the new indexes are applied here. Every step is a no-op on a
+# fresh or already upgraded database.
+_PRIORITY_RANK_CASE = " ".join(
+    f"WHEN '{priority.name}' THEN {rank}" for priority, rank in PRIORITY_RANKS.items()
+)
+JOBS_UPGRADE_DDL = f"""
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS payload_hash VARCHAR(64);
+ALTER TABLE jobs ADD COLUMN IF NOT EXISTS attempts INTEGER NOT NULL DEFAULT 0;
+ALTER TABLE jobs ALTER COLUMN position_in_queue SET DEFAULT nextval('jobs_queue_pos_seq');
+
+DROP INDEX IF EXISTS ix_jobs_priority;
+DROP INDEX IF EXISTS ix_jobs_status;
+DO $$
+BEGIN
+    IF (SELECT data_type FROM information_schema.columns
+        WHERE table_name = 'jobs' AND column_name = 'priority') <> 'smallint' THEN
+        ALTER TABLE jobs ALTER COLUMN priority TYPE SMALLINT
+            USING CASE priority::text {_PRIORITY_RANK_CASE} END;
+    END IF;
+END $$;
+
+CREATE INDEX IF NOT EXISTS idx_jobs_dedupe ON jobs (job_type, status, payload_hash);
+CREATE INDEX IF NOT EXISTS idx_jobs_listing ON jobs (status, priority, created_at DESC);
+CREATE INDEX IF NOT EXISTS ix_job_ready ON jobs (priority, created_at) WHERE status = 'pending';
+"""
+
+
 def init_db():
     from app.models import job  # Import all models here
     Base.metadata.create_all(bind=engine)
+    with engine.begin() as conn:
+        conn.exec_driver_sql(JOBS_UPGRADE_DDL)
+        conn.exec_driver_sql(JOBS_NOTIFY_DDL)
+
+    from app.services.job_service import backfill_payload_hashes, init_resource_pool
+    with SessionLocal() as db:
+        init_resource_pool(db)
+        backfill_payload_hashes(db)
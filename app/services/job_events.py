@@ -0,0 +1,112 @@
+import asyncio
+import logging
+from typing import Optional, Set
+import psycopg2
+import psycopg2.extensions
+from app.services.database import DATABASE_URL
+
+logger = logging.getLogger(__name__)
+
+# Channel the jobs_notify trigger publishes job changes on
+JOBS_CHANNEL = "jobs_channel"
+
+# Delay before retrying the LISTEN connection after it failed or was lost
+RECONNECT_DELAY_SECONDS = 5.0
+CONNECT_TIMEOUT_SECONDS = 5
+
+# Events buffered per WebSocket; a client that falls further behind loses its oldest events
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class JobEventBroadcaster:
+    """
+    Fans out NOTIFY payloads from JOBS_CHANNEL to WebSocket subscribers.
+
+    A single LISTEN connection is shared by all subscribers. Its socket is
+    registered with the event loop, so a change is pushed as soon as the
+    transaction that made it commits, without polling. If the connection
+    cannot be opened or is lost, the stream pauses and the connection is
+    retried every RECONNECT_DELAY_SECONDS; changes made meanwhile are missed.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL):
+        self._dsn = dsn
+        self._conn = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._reconnect: Optional[asyncio.TimerHandle] = None
+        self._subscribers: Set[asyncio.Queue] = set()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._connect()
+
+    def stop(self):
+        if self._reconnect is not None:
+            self._reconnect.cancel()
+            self._reconnect = None
+        self._disconnect()
+
+    def subscribe(self) -> asyncio.Queue:
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def _connect(self):
+        self._reconnect = None
+        conn = None
+        try:
+            conn = psycopg2.connect(self._dsn, connect_timeout=CONNECT_TIMEOUT_SECONDS)
+            conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+            with conn.cursor() as cursor:
+                cursor.execute(f"LISTEN {JOBS_CHANNEL}")
+        except psycopg2.Error as e:
+            logger.warning("Job event listener unavailable, retrying in %ss: %s", RECONNECT_DELAY_SECONDS, e)
+            if conn is not None:
+                conn.close()
+            self._schedule_reconnect()
+            return
+        self._conn = conn
+        self._loop.add_reader(conn.fileno(), self._on_notify)
+
+    def _disconnect(self):
+        if self._conn is None:
+            return
+        self._loop.remove_reader(self._conn.fileno())
+        try:
+            self._conn.close()
+        except psycopg2.Error:
+            pass
+        self._conn = None
+
+    def _schedule_reconnect(self):
+        self._reconnect = self._loop.call_later(RECONNECT_DELAY_SECONDS, self._connect)
+
+    def _on_notify(self):
+        try:
+            self._conn.poll()
+        except psycopg2.Error as e:
+            logger.warning("Job event listener lost, reconnecting in %ss: %s", RECONNECT_DELAY_SECONDS, e)
+            self._disconnect()
+            self._schedule_reconnect()
+            return
+
+        while self._conn.notifies:
+            payload = self._conn.notifies.pop(0).payload
+            for queue in self._subscribers:
+                self._publish(queue, payload)
+
+    @staticmethod
+    def _publish(queue: asyncio.Queue, payload: str):
+        try:
+            queue.put_nowait(payload)
+        except asyncio.QueueFull:
+            # Slow client: drop its oldest event rather than growing without bound
+            queue.get_nowait()
+            queue.put_nowait(payload)
+            logger.debug("Job event subscriber full, dropped oldest event")
+
+
+job_events = JobEventBroadcaster()
@@ -1,90 +1,212 @@
+import hashlib
+import json
+import threading
 import uuid
 import time
+from collections import OrderedDict
 from datetime import datetime
-from typing import List, Optional
+from typing import Callable, Dict, Iterator, List, Optional, Tuple, Union
+from sqlalchemy import exists, func, insert, select, text, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.orm import Session
-from app.models.job import Job, JobLog, JobCreate, JobStatus, JobPriority, JobType
-
-# Simulated in-memory resource pool (not thread-safe)
+from app.models.job import (
+    Job, JobLog, JobCreate, JobStatus, JobPriority, JobType, ResourcePool, job_dependencies
+)
+from app.services.log_writer import log_writer
+
+# Rows fetched per server-side cursor round-trip when streaming job logs / job listings
+LOG_STREAM_BATCH_SIZE = 500
+LIST_STREAM_BATCH_SIZE = 256
+
+# Read-through cache of job detail snapshots served by GET /jobs/{job_id}
+JOB_CACHE_TTL_SECONDS = 1.0
+JOB_CACHE_MAXSIZE = 10_000
+_job_cache: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+_job_cache_lock = threading.Lock()
+
+# Shared resource pool capacity, tracked in the single resource_pool row
 TOTAL_CPU_UNITS = 8
 TOTAL_MEMORY_MB = 4096
-used_cpu_units = 0
-used_memory_mb = 0
+RESOURCE_POOL_ID = 1
+
+# Channel the worker LISTENs on to wake up when new jobs are committed
+NEW_JOB_CHANNEL = "job_new"
 
 def create_job(db: Session, job_data: JobCreate) -> Job:
     """
     Create a new job and add it to the database.
+    Goes through create_jobs, so dependency edges are written with one bulk INSERT.
     """
-    job_id = f"job_{uuid.uuid4().hex[:8]}"
-
-    # Prevent duplicate job - Using JSONB cast for comparison
-    from sqlalchemy.dialects.postgresql import JSONB
-    from sqlalchemy import cast
-    
-    existing_job = db.query(Job).filter(
-        Job.job_type == job_data.type,
-        cast(Job.payload, JSONB) == job_data.payload,
-        Job.status.in_([JobStatus.pending, JobStatus.running])
-    ).first()
-    if existing_job:
-        raise ValueError(f"Duplicate job detected (ID: {existing_job.job_id})")
-
-    # Create job
-    job = Job(
-        job_id=job_id,
-        job_type=job_data.type,
-        priority=job_data.priority,
-        payload=job_data.payload,
-        resource_requirements={
-            "cpu_units": job_data.resource_requirements.cpu_units,
-            "memory_mb": job_data.resource_requirements.memory_mb
-        },
-        retry_config=job_data.retry_config.dict() if job_data.retry_config else None,
-        timeout_seconds=job_data.timeout_seconds,
-        status=JobStatus.pending,
-        position_in_queue=db.query(Job).filter(Job.status == JobStatus.pending).count() + 1
-    )
+    (job_id,) = create_jobs(db, [job_data])
+    return get_job(db, job_id)
+
+def create_jobs(db: Session, jobs_data: List[JobCreate],
+                job_ids: Optional[List[str]] = None) -> List[str]:
+    """
+    Create a batch of jobs in one transaction using bulk INSERTs and return their IDs.
+    The jobs are not loaded back; use get_job for the ones the caller needs.
+    A job may depend on existing jobs or on jobs earlier in the same batch;
+    `job_ids` lets the caller choose the new IDs up front to wire those up.
+    """
+    if not jobs_data:
+        return []
+    if job_ids is None:
+        job_ids = [_new_job_id() for _ in jobs_data]
+    hashes = [_payload_hash(job_data.payload) for job_data in jobs_data]
+
+    # Prevent duplicate jobs, against the database and within the batch
+    active: Dict[Tuple[JobType, str], str] = {
+        (job_type, payload_hash): job_id
+        for job_id, job_type, payload_hash in db.query(Job.job_id, Job.job_type, Job.payload_hash).filter(
+            Job.job_type.in_({job_data.type for job_data in jobs_data}),
+            Job.status.in_([JobStatus.pending, JobStatus.running]),
+            Job.payload_hash.in_(set(hashes))
+        )
+    }
+    for job_id, job_data, payload_hash in zip(job_ids, jobs_data, hashes):
+        existing_id = active.setdefault((job_data.type, payload_hash), job_id)
+        if existing_id != job_id:
+            raise ValueError(f"Duplicate job detected (ID: {existing_id})")
 
     # Validate dependencies
-    for dep_id in job_data.depends_on:
-        if dep_id == job_id:
-            raise ValueError("Self-dependency detected")
-        dep_job = db.query(Job).filter(Job.job_id == dep_id).first()
-        if not dep_job:
-            raise ValueError(f"Dependency job {dep_id} not found")
-        job.depends_on.append(dep_job)
-
-    db.add(job)
+    dep_ids = {dep_id for job_data in jobs_data for dep_id in job_data.depends_on}
+    known_ids = {
+        job_id for (job_id,) in db.query(Job.job_id).filter(Job.job_id.in_(dep_ids))
+    } if dep_ids else set()
+    dep_rows = []
+    for job_id, job_data in zip(job_ids, jobs_data):
+        for dep_id in job_data.depends_on:
+            if dep_id == job_id:
+                raise ValueError("Self-dependency detected")
+            if dep_id not in known_ids:
+                raise ValueError(f"Dependency job {dep_id} not found")
+            dep_rows.append({"job_id": job_id, "depends_on_id": dep_id})
+        known_ids.add(job_id)
+
+    rows = [
+        {
+            "job_id": job_id,
+            "job_type": job_data.type,
+            "priority": job_data.priority,
+            "status": JobStatus.pending,
+            "payload": job_data.payload,
+            "payload_hash": payload_hash,
+            "resource_requirements": job_data.resource_requirements.dict(),
+            "retry_config": job_data.retry_config.dict() if job_data.retry_config else None,
+            "timeout_seconds": job_data.timeout_seconds,
+        }
+        for job_id, job_data, payload_hash in zip(job_ids, jobs_data, hashes)
+    ]
+    db.execute(insert(Job), rows)
+    if dep_rows:
+        db.execute(insert(job_dependencies), dep_rows)
+    db.execute(insert(JobLog), [
+        {"job_id": job_id, "status": JobStatus.pending, "message": "Job created"} for job_id in job_ids
+    ])
+    _notify_new_jobs(db)
     db.commit()
-    db.refresh(job)
+    return job_ids
 
-    # Log creation
-    db.add(JobLog(job_id=job_id, status=JobStatus.pending, message="Job created"))
-    db.commit()
+def _notify_new_jobs(db: Session):
+    """
+    Queue a NOTIFY for the worker; Postgres delivers it only if the transaction commits.
+    """
+    db.execute(text(f"NOTIFY {NEW_JOB_CHANNEL}"))
 
-    return job
+def _new_job_id() -> str:
+    return f"job_{uuid.uuid4().hex[:8]}"
+
+def _payload_hash(payload: dict) -> str:
+    """
+    Deterministic SHA-256 of the payload's canonical JSON form.
+    """
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
 
 def get_job(db: Session, job_id: str) -> Optional[Job]:
-    return db.query(Job).filter(Job.job_id == job_id).first()
+    # Served from the session's identity map when the job is already loaded
+    return db.get(Job, job_id)
 
-def list_jobs(db: Session, status: Optional[JobStatus] = None,
-              priority: Optional[str] = None,
-              type: Optional[str] = None,
-              skip: int = 0, limit: int = 100) -> List[Job]:
-    query = db.query(Job)
+def get_job_detail(db: Session, job_id: str) -> Optional[dict]:
+    """
+    Detached snapshot of a job shaped like JobDetailResponse, served from a
+    short-lived in-process cache. Mutations made in this process invalidate
+    the entry; changes made by other processes show up within
+    JOB_CACHE_TTL_SECONDS.
+    """
+    now = time.monotonic()
+    with _job_cache_lock:
+        entry = _job_cache.get(job_id)
+        if entry and entry[0] > now:
+            _job_cache.move_to_end(job_id)
+            return entry[1]
+
+    job = get_job(db, job_id)
+    if not job:
+        return None
+    detail = {
+        "job_id": job.job_id,
+        "status": job.status,
+        "created_at": job.created_at,
+        "priority": job.priority,
+        "position_in_queue": job.position_in_queue,
+        "type": job.job_type,
+        "payload": job.payload,
+        "resource_requirements": job.resource_requirements,
+        "depends_on": [dep.job_id for dep in job.depends_on],
+        "retry_config": job.retry_config,
+        "timeout_seconds": job.timeout_seconds,
+        "updated_at": job.updated_at,
+        "completed_at": job.completed_at,
+    }
+    with _job_cache_lock:
+        _job_cache[job_id] = (now + JOB_CACHE_TTL_SECONDS, detail)
+        _job_cache.move_to_end(job_id)
+        while len(_job_cache) > JOB_CACHE_MAXSIZE:
+            _job_cache.popitem(last=False)
+    return detail
+
+def invalidate_job(job_id: str):
+    with _job_cache_lock:
+        _job_cache.pop(job_id, None)
+
+def _job_filters(status: Optional[JobStatus], priority: Optional[JobPriority],
+                 type: Optional[JobType]) -> list:
+    conditions = []
     if status:
-        query = query.filter(Job.status == status)
+        conditions.append(Job.status == status)
     if priority:
-        try:
-            query = query.filter(Job.priority == JobPriority(priority))
-        except ValueError:
-            pass
+        conditions.append(Job.priority == priority)
     if type:
-        try:
-            query = query.filter(Job.job_type == JobType(type))
-        except ValueError:
-            pass
-    return query.offset(skip).limit(limit).all()
+        conditions.append(Job.job_type == type)
+    return conditions
+
+def list_jobs(db: Session, status: Optional[JobStatus] = None,
+              priority: Optional[JobPriority] = None,
+              type: Optional[JobType] = None,
+              skip: int = 0, limit: int = 100,
+              stream: bool = False) -> Union[List[Job], Iterator[Job]]:
+    """
+    List jobs matching the filters. With stream=True the rows are fetched from a
+    server-side cursor LIST_STREAM_BATCH_SIZE at a time and returned as an iterator.
+    """
+    stmt = (
+        select(Job)
+        .where(*_job_filters(status, priority, type))
+        .order_by(Job.priority, Job.created_at.desc())
+        .offset(skip)
+        .limit(limit)
+    )
+    if stream:
+        return db.execute(stmt.execution_options(yield_per=LIST_STREAM_BATCH_SIZE)).scalars()
+    return db.execute(stmt).scalars().all()
+
+def count_jobs(db: Session, status: Optional[JobStatus] = None,
+               priority: Optional[JobPriority] = None,
+               type: Optional[JobType] = None) -> int:
+    return db.scalar(
+        select(func.count()).select_from(Job).where(*_job_filters(status, priority, type))
+    )
 
 def cancel_job(db: Session, job_id: str) -> Optional[Job]:
     job = db.query(Job).filter(Job.job_id == job_id).first()
@@ -93,105 +215,263 @@ def cancel_job(db: Session, job_id: str) -> Optional[Job]:
     if job.status not in [JobStatus.pending, JobStatus.running]:
         raise ValueError(f"Cannot cancel job in '{job.status}' state")
 
-    was_running = job.status == JobStatus.running
     job.status = JobStatus.cancelled
     job.updated_at = datetime.utcnow()
+    _add_log(db, job_id, JobStatus.cancelled, "Job cancelled by user")
     db.commit()
-    db.refresh(job)
-
-    db.add(JobLog(job_id=job_id, status=JobStatus.cancelled, message="Job cancelled by user"))
-    db.commit()
-
-    if was_running:
-        _release_resources(job)
+    invalidate_job(job_id)
 
+    # A running job's resources are released by the worker executing it once
+    # it notices the cancellation.
     return job
 
-def get_job_logs(db: Session, job_id: str) -> Optional[List[JobLog]]:
-    job = db.query(Job).filter(Job.job_id == job_id).first()
-    if not job:
+def get_job_logs(db: Session, job_id: str) -> Optional[Iterator[JobLog]]:
+    """
+    Iterate a job's logs in creation order, or return None if the job does not exist.
+    Rows are streamed from a server-side cursor instead of being loaded all at once.
+    """
+    # Jobs are never deleted, so a cached snapshot is enough to prove existence
+    if get_job_detail(db, job_id) is None:
         return None
-    return db.query(JobLog).filter(JobLog.job_id == job_id).order_by(JobLog.created_at).all()
+    stmt = (
+        select(JobLog)
+        .where(JobLog.job_id == job_id)
+        .order_by(JobLog.created_at)
+        .execution_options(yield_per=LOG_STREAM_BATCH_SIZE)
+    )
+    return db.execute(stmt).scalars()
 
 def can_execute_job(db: Session, job: Job) -> bool:
-    for dep in job.depends_on:
-        if dep.status != JobStatus.completed:
-            return False
-
-    cpu_needed = job.resource_requirements.get("cpu_units", 0)
-    mem_needed = job.resource_requirements.get("memory_mb", 0)
-    return (used_cpu_units + cpu_needed <= TOTAL_CPU_UNITS and
-            used_memory_mb + mem_needed <= TOTAL_MEMORY_MB)
-
-def execute_job(db: Session, job: Job) -> bool:
-    global used_cpu_units, used_memory_mb
-
-    cpu = job.resource_requirements.get("cpu_units", 0)
-    mem = job.resource_requirements.get("memory_mb", 0)
+    # One EXISTS probe for any unfinished dependency instead of loading each one
+    blocked = db.scalar(select(exists().where(
+        job_dependencies.c.job_id == job.job_id,
+        job_dependencies.c.depends_on_id == Job.job_id,
+        Job.status != JobStatus.completed
+    )))
+    return not blocked
+
+def init_resource_pool(db: Session):
+    """
+    Create the resource pool row, or update its capacity to the configured totals.
+    """
+    stmt = pg_insert(ResourcePool).values(
+        id=RESOURCE_POOL_ID,
+        total_cpu_units=TOTAL_CPU_UNITS,
+        total_memory_mb=TOTAL_MEMORY_MB,
+        used_cpu_units=0,
+        used_memory_mb=0
+    )
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[ResourcePool.id],
+        set_={"total_cpu_units": TOTAL_CPU_UNITS, "total_memory_mb": TOTAL_MEMORY_MB}
+    ))
+    db.commit()
 
-    used_cpu_units += cpu
-    used_memory_mb += mem
+def recover_orphaned_jobs(db: Session) -> int:
+    """
+    Requeue jobs left running by a worker that stopped, and rebuild the pool's
+    used capacity from the jobs still running. Only safe while no other worker
+    is live (run_worker checks this), since their running jobs would be
+    requeued as well. Returns the number of jobs requeued.
+    """
+    requeued = db.execute(
+        update(Job)
+        .where(Job.status == JobStatus.running)
+        .values(status=JobStatus.pending, updated_at=datetime.utcnow())
+        .returning(Job.job_id)
+        .execution_options(synchronize_session=False)
+    ).scalars().all()
+    if requeued:
+        db.execute(insert(JobLog), [
+            {"job_id": job_id, "status": JobStatus.pending, "message": "Job requeued after its worker stopped"}
+            for job_id in requeued
+        ])
+
+    used_cpu, used_memory = db.execute(
+        select(
+            func.coalesce(func.sum(Job.resource_requirements["cpu_units"].as_integer()), 0),
+            func.coalesce(func.sum(Job.resource_requirements["memory_mb"].as_integer()), 0),
+        ).where(Job.status == JobStatus.running)
+    ).one()
+    db.execute(
+        update(ResourcePool)
+        .where(ResourcePool.id == RESOURCE_POOL_ID)
+        .values(used_cpu_units=used_cpu, used_memory_mb=used_memory)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    for job_id in requeued:
+        invalidate_job(job_id)
+    return len(requeued)
 
-    job.status = JobStatus.running
-    job.updated_at = datetime.utcnow()
+def backfill_payload_hashes(db: Session):
+    """
+    Hash the payloads of active jobs created before payload_hash existed, so
+    duplicate detection covers them too.
+    """
+    rows = [
+        {"job_id": job_id, "payload_hash": _payload_hash(payload)}
+        for job_id, payload in db.query(Job.job_id, Job.payload).filter(
+            Job.payload_hash.is_(None),
+            Job.status.in_([JobStatus.pending, JobStatus.running])
+        )
+    ]
+    if rows:
+        db.execute(update(Job), rows)
     db.commit()
-    db.refresh(job)
 
-    db.add(JobLog(job_id=job.job_id, status=JobStatus.running, message="Job execution started"))
+def claim_job(db: Session, job: Job) -> bool:
+    """
+    Atomically mark a pending job running and claim its CPU and memory from the pool.
+    Returns False, leaving nothing changed, if another worker already claimed
+    the job or the pool cannot fit it.
+    A failed claim rolls back only its own savepoint, so objects the caller
+    loaded in the same session are not expired.
+    """
+    savepoint = db.begin_nested()
+    # One statement claims the row: the status guard stops a second claim, and
+    # SKIP LOCKED makes a worker give up on a row another worker is claiming
+    # right now instead of waiting for that transaction
+    claimable = (
+        select(Job.job_id)
+        .where(Job.job_id == job.job_id, Job.status == JobStatus.pending)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    claimed = db.execute(
+        update(Job)
+        .where(Job.job_id == claimable)
+        .values(status=JobStatus.running, updated_at=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    if claimed.rowcount != 1 or not _reserve_resources(db, job):
+        savepoint.rollback()
+        # End the outer transaction too so the session does not sit idle in it
+        db.commit()
+        return False
+    savepoint.commit()
+    _add_log(db, job.job_id, JobStatus.running, "Job execution started")
     db.commit()
+    invalidate_job(job.job_id)
+    return True
+
+def perform_job(job_type: JobType, payload: dict):
+    """
+    Do the actual work of a job. This never touches the database, so it can run
+    on a worker thread or in a separate process.
+    """
+    time.sleep(0.5)  # Simulate job execution
 
+def execute_job(db: Session, job: Job,
+                perform: Callable[[JobType, dict], None] = perform_job) -> bool:
+    """
+    Run a job that was already marked running, with its resources claimed, by claim_job.
+    `perform` does the work itself; the scheduler passes one that runs it in
+    the job type's task pool.
+    """
     try:
-        time.sleep(0.5)  # Simulate job execution
+        job_type, payload = job.job_type, job.payload
+        # End the read transaction so no pooled connection sits idle in
+        # transaction while the job runs; the job is re-read afterwards
+        db.commit()
+        perform(job_type, payload)
 
         db.refresh(job)
         if job.status == JobStatus.cancelled:
-            db.add(JobLog(job_id=job.job_id, status=JobStatus.cancelled, message="Job was cancelled during execution"))
+            _add_log(db, job.job_id, JobStatus.cancelled, "Job was cancelled during execution")
+            _release_resources(db, job)
             db.commit()
-            _release_resources(job)
+            invalidate_job(job.job_id)
             return False
 
         job.status = JobStatus.completed
         job.updated_at = datetime.utcnow()
         job.completed_at = datetime.utcnow()
+        _add_log(db, job.job_id, JobStatus.completed, "Job completed successfully")
+        _release_resources(db, job)
         db.commit()
-
-        db.add(JobLog(job_id=job.job_id, status=JobStatus.completed, message="Job completed successfully"))
-        db.commit()
-
-        _release_resources(job)
+        invalidate_job(job.job_id)
         return True
 
     except Exception as e:
         return _handle_job_failure(db, job, str(e))
 
 def _handle_job_failure(db: Session, job: Job, error: str) -> bool:
+    # Discard anything the failed step left unflushed or half-committed
+    db.rollback()
+
     retry_config = job.retry_config or {"max_attempts": 1, "backoff_multiplier": 2}
-    attempts = db.query(JobLog).filter(JobLog.job_id == job.job_id, JobLog.status == JobStatus.failed).count()
+    attempts = job.attempts
+    job.attempts = attempts + 1
 
     if attempts < retry_config["max_attempts"]:
         backoff = retry_config["backoff_multiplier"] ** attempts
         job.status = JobStatus.pending
         job.updated_at = datetime.utcnow()
+        _add_log(db, job.job_id, JobStatus.failed,
+                 f"Job failed (attempt {attempts + 1}): {error}. Retrying after {backoff}s")
+        _release_resources(db, job)
         db.commit()
-
-        db.add(JobLog(job_id=job.job_id, status=JobStatus.failed,
-                      message=f"Job failed (attempt {attempts + 1}): {error}. Retrying after {backoff}s"))
-        db.commit()
+        invalidate_job(job.job_id)
         time.sleep(backoff)
-        _release_resources(job)
         return False
     else:
         job.status = JobStatus.failed
         job.updated_at = datetime.utcnow()
+        _add_log(db, job.job_id, JobStatus.failed,
+                 f"Job permanently failed after {attempts} attempts: {error}")
+        _release_resources(db, job)
         db.commit()
-
-        db.add(JobLog(job_id=job.job_id, status=JobStatus.failed,
-                      message=f"Job permanently failed after {attempts} attempts: {error}"))
-        db.commit()
-        _release_resources(job)
+        invalidate_job(job.job_id)
         return False
 
-def _release_resources(job: Job):
-    global used_cpu_units, used_memory_mb
-    used_cpu_units -= job.resource_requirements.get("cpu_units", 0)
-    used_memory_mb -= job.resource_requirements.get("memory_mb", 0)
+def _add_log(db: Session, job_id: str, status: JobStatus, message: str):
+    """
+    Record a job log line. Outside the worker (API, tests) the line joins the
+    caller's transaction, so it commits atomically with the status change.
+    In the worker, lines go through the batching log_writer instead and are
+    written shortly after the status change commits: a worker crash can leave
+    a job's latest transition without its log row, and lines still buffered
+    are lost. The jobs table, not job_logs, is the source of truth for status.
+    """
+    if log_writer.running:
+        log_writer.write(job_id, status, message)
+    else:
+        db.add(JobLog(job_id=job_id, status=status, message=message))
+
+def _reserve_resources(db: Session, job: Job) -> bool:
+    """
+    Claim the job's CPU and memory from the pool as part of the caller's transaction.
+    Returns False without reserving anything if the pool cannot fit the job.
+    """
+    cpu = job.resource_requirements.get("cpu_units", 0)
+    mem = job.resource_requirements.get("memory_mb", 0)
+    # Check-and-increment in one conditional UPDATE on the locked pool row
+    result = db.execute(
+        update(ResourcePool)
+        .where(
+            ResourcePool.id == RESOURCE_POOL_ID,
+            ResourcePool.used_cpu_units + cpu <= ResourcePool.total_cpu_units,
+            ResourcePool.used_memory_mb + mem <= ResourcePool.total_memory_mb
+        )
+        .values(
+            used_cpu_units=ResourcePool.used_cpu_units + cpu,
+            used_memory_mb=ResourcePool.used_memory_mb + mem
+        )
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+def _release_resources(db: Session, job: Job):
+    """
+    Return the job's CPU and memory to the pool as part of the caller's transaction.
+    """
+    db.execute(
+        update(ResourcePool)
+        .where(ResourcePool.id == RESOURCE_POOL_ID)
+        .values(
+            used_cpu_units=ResourcePool.used_cpu_units - job.resource_requirements.get("cpu_units", 0),
+            used_memory_mb=ResourcePool.used_memory_mb - job.resource_requirements.get("memory_mb", 0)
+        )
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,90 @@
+import logging
+import queue
+import threading
+from datetime import datetime
+from typing import List, Optional
+from sqlalchemy import insert
+from app.models.job import JobLog, JobStatus
+from app.services.database import SessionLocal
+
+# Buffered rows are flushed at least this often, in INSERTs of at most LOG_FLUSH_BATCH_SIZE rows
+LOG_FLUSH_INTERVAL_SECONDS = 0.01
+LOG_FLUSH_BATCH_SIZE = 500
+
+logger = logging.getLogger(__name__)
+
+
+class JobLogWriter:
+    """
+    Buffers JobLog rows and inserts them in batches from a background thread.
+
+    The worker starts one so a burst of job transitions turns into a few
+    multi-row INSERTs instead of one round-trip per log line. Rows are
+    timestamped when written, not when flushed, so log order is preserved.
+    A batch whose INSERT fails is kept and retried ahead of newer rows.
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+        # Rows taken off the queue whose INSERT has not succeeded yet
+        self._unflushed: List[dict] = []
+        self._stopping = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="job-log-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self._thread.join()
+        self._thread = None
+        try:
+            while self.flush():
+                pass
+        except Exception:
+            logger.exception("Dropping %d unflushed job log rows", len(self._unflushed) + self._queue.qsize())
+
+    def write(self, job_id: str, status: JobStatus, message: str):
+        self._queue.put({
+            "job_id": job_id,
+            "status": status,
+            "message": message,
+            "created_at": datetime.utcnow(),
+        })
+
+    def flush(self) -> int:
+        """
+        Insert up to LOG_FLUSH_BATCH_SIZE buffered rows and return how many were written.
+        """
+        rows = self._unflushed
+        while len(rows) < LOG_FLUSH_BATCH_SIZE:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._unflushed = rows  # kept for the next flush if the INSERT fails
+        if rows:
+            with SessionLocal() as db:
+                db.execute(insert(JobLog), rows)
+                db.commit()
+        self._unflushed = []
+        return len(rows)
+
+    def _run(self):
+        while not self._stopping.wait(LOG_FLUSH_INTERVAL_SECONDS):
+            try:
+                while self.flush() == LOG_FLUSH_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logger.error("Job log flush error, will retry: %s", e)
+
+
+log_writer = JobLogWriter()
@@ -0,0 +1,192 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Dict, Set
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from app.models.job import Job, JobStatus, JobType
+from app.services.database import SessionLocal
+from app.services.job_service import (
+    can_execute_job, claim_job, execute_job, perform_job, _release_resources
+)
+
+logger = logging.getLogger(__name__)
+
+# Task pools: "atp" runs I/O-bound jobs on threads, "wtp" runs compute-bound
+# jobs in separate processes so they are not serialized by the GIL
+ASYNC_TASK_POOL = "atp"
+WORKER_TASK_POOL = "wtp"
+
+POOL_FOR_TYPE: Dict[JobType, str] = {
+    JobType.email: ASYNC_TASK_POOL,
+    JobType.data_export: ASYNC_TASK_POOL,
+    JobType.report_generation: WORKER_TASK_POOL,
+}
+
+# Maximum number of jobs executing at the same time in each pool of one worker process
+MAX_CONCURRENCY = int(os.getenv("MAX_CONCURRENCY", "16"))
+POOL_CONCURRENCY: Dict[str, int] = {
+    ASYNC_TASK_POOL: MAX_CONCURRENCY,
+    WORKER_TASK_POOL: int(os.getenv("WTP_CONCURRENCY", str(os.cpu_count() or 1))),
+}
+
+# Per job type caps, enforced inside the pool cap
+GROUP_CONCURRENCY: Dict[JobType, int] = {
+    JobType.email: 16,
+    JobType.data_export: 4,
+    JobType.report_generation: 2,
+}
+
+
+class Scheduler:
+    """
+    Runs admitted jobs on bounded task pools.
+
+    Each job type maps to a pool (POOL_FOR_TYPE). A semaphore per pool caps how
+    many of its jobs execute at once and a second semaphore per job type caps
+    each resource class; a job starts only when both have a free slot. The
+    worker offers jobs in priority order (critical -> high -> normal -> low),
+    so the highest-priority job that fits takes the next free slot.
+
+    Job bookkeeping always runs on a thread; for WTP jobs that thread hands the
+    work itself to a process pool and waits for it.
+    """
+
+    def __init__(self, pool_concurrency: Dict[str, int] = POOL_CONCURRENCY,
+                 group_concurrency: Dict[JobType, int] = GROUP_CONCURRENCY):
+        self._pool_slots = {
+            pool: threading.BoundedSemaphore(size) for pool, size in pool_concurrency.items()
+        }
+        self._group_slots = {
+            job_type: threading.BoundedSemaphore(
+                self._group_limit(job_type, pool_concurrency, group_concurrency))
+            for job_type in JobType
+        }
+        # Most jobs that can be executing at once, given both caps
+        self.max_running = sum(
+            min(size, sum(self._group_limit(job_type, pool_concurrency, group_concurrency)
+                          for job_type, job_pool in POOL_FOR_TYPE.items() if job_pool == pool))
+            for pool, size in pool_concurrency.items()
+        )
+        self._executor = ThreadPoolExecutor(max_workers=sum(pool_concurrency.values()),
+                                            thread_name_prefix="job")
+        # The worker is multi-threaded, so start WTP processes with spawn rather than fork
+        self._wtp = ProcessPoolExecutor(max_workers=pool_concurrency[WORKER_TASK_POOL],
+                                        mp_context=multiprocessing.get_context("spawn"))
+        self._lock = threading.Lock()
+        self._inflight: Set[str] = set()
+
+    @staticmethod
+    def _group_limit(job_type: JobType, pool_concurrency: Dict[str, int],
+                     group_concurrency: Dict[JobType, int]) -> int:
+        return group_concurrency.get(job_type, pool_concurrency[POOL_FOR_TYPE[job_type]])
+
+    def submit(self, db: Session, job: Job) -> bool:
+        """
+        Start the job in the background if a slot, its dependencies and its
+        resources are all available and no other worker claimed it first.
+        Returns False if the job was not admitted.
+        """
+        with self._lock:
+            if job.job_id in self._inflight:
+                return False
+        if not self._acquire_slots(job.job_type):
+            return False
+        try:
+            admitted = can_execute_job(db, job) and claim_job(db, job)
+        except Exception:
+            self._release_slots(job.job_type)
+            raise
+        if not admitted:
+            self._release_slots(job.job_type)
+            return False
+
+        with self._lock:
+            self._inflight.add(job.job_id)
+        self._executor.submit(self._run, job.job_id, job.job_type)
+        return True
+
+    def is_inflight(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._inflight
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+        self._wtp.shutdown(wait=wait)
+
+    def _acquire_slots(self, job_type: JobType) -> bool:
+        pool_slots = self._pool_slots[POOL_FOR_TYPE[job_type]]
+        if not pool_slots.acquire(blocking=False):
+            return False
+        if not self._group_slots[job_type].acquire(blocking=False):
+            pool_slots.release()
+            return False
+        return True
+
+    def _release_slots(self, job_type: JobType):
+        self._group_slots[job_type].release()
+        self._pool_slots[POOL_FOR_TYPE[job_type]].release()
+
+    def _perform_in_wtp(self, job_type: JobType, payload: dict):
+        self._wtp.submit(perform_job, job_type, payload).result()
+
+    def _run(self, job_id: str, job_type: JobType):
+        perform = self._perform_in_wtp if POOL_FOR_TYPE[job_type] == WORKER_TASK_POOL else perform_job
+        db = SessionLocal()
+        job = None
+        try:
+            job = db.get(Job, job_id)
+            success = execute_job(db, job, perform=perform)
+            logger.info("Job %s %s", job_id, "completed" if success else "failed")
+        except Exception as job_error:
+            logger.error("Error processing job %s: %s", job_id, job_error)
+            # execute_job releases resources in its final commit, so reaching
+            # here means they are still reserved
+            if job is not None:
+                db.rollback()
+                _release_resources(db, job)
+                db.commit()
+        finally:
+            db.close()
+            with self._lock:
+                self._inflight.discard(job_id)
+            self._release_slots(job_type)
+
+
+def get_stats(db: Session) -> dict:
+    """
+    Pending and running job counts per job type and per pool, alongside the
+    configured concurrency limits. Counts come from the database so they cover
+    every worker process.
+    """
+    counts = (
+        db.query(Job.job_type, Job.status, func.count())
+        .filter(Job.status.in_([JobStatus.pending, JobStatus.running]))
+        .group_by(Job.job_type, Job.status)
+        .all()
+    )
+    groups = {
+        job_type: {
+            "pool": POOL_FOR_TYPE[job_type],
+            "limit": GROUP_CONCURRENCY.get(job_type, POOL_CONCURRENCY[POOL_FOR_TYPE[job_type]]),
+            "pending": 0,
+            "running": 0,
+        }
+        for job_type in JobType
+    }
+    for job_type, status, count in counts:
+        groups[job_type][status.value] = count
+
+    pools = {pool: {"limit": size, "running": 0} for pool, size in POOL_CONCURRENCY.items()}
+    for group in groups.values():
+        pools[group["pool"]]["running"] += group["running"]
+
+    return {
+        "max_concurrency": sum(POOL_CONCURRENCY.values()),
+        "running": sum(group["running"] for group in groups.values()),
+        "pending": sum(group["pending"] for group in groups.values()),
+        "pools": pools,
+        "groups": groups,
+    }
@@ -0,0 +1,26 @@
+import pytest
+from sqlalchemy.orm import Session
+from app.services.database import engine, init_db
+
+@pytest.fixture(scope="session")
+def test_engine():
+    """
+    Create the schema once per test session and share the app engine's pool.
+    """
+    init_db()
+    yield engine
+    engine.dispose()
+
+@pytest.fixture(scope="function")
+def db_session(test_engine):
+    """
+    Run each test inside an outer transaction that is rolled back on teardown.
+    Service-level commits only release a SAVEPOINT, so no rows outlive the test.
+    """
+    connection = test_engine.connect()
+    trans = connection.begin()
+    session = Session(bind=connection, join_transaction_mode="create_savepoint")
+    yield session
+    session.close()
+    trans.rollback()
+    connection.close()
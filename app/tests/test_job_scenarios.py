@@ -1,65 +1,123 @@
 import pytest
 from sqlalchemy.orm import Session
-from app.services.database import SessionLocal
-from app.models.job import JobCreate, JobType, JobPriority, ResourceRequirements, RetryConfig, JobStatus
-from app.services.job_service import create_job, get_job, list_jobs
-from typing import Dict, List, Optional
+from app.models.job import JobCreate, JobType, JobPriority, ResourcePool, ResourceRequirements, RetryConfig, JobStatus
+from app.services.job_service import (
+    RESOURCE_POOL_ID, cancel_job, claim_job, count_jobs, create_jobs, execute_job, get_job,
+    recover_orphaned_jobs
+)
+from typing import Dict, Iterable, List, Optional
+from collections import deque, namedtuple
+import os
 
-@pytest.fixture(scope="function")
-def db_session():
-    db = SessionLocal()
-    yield db
-    db.close()
+# Accept either enum names or values in job definitions
+_JOB_TYPE_MAP = {m.name: m for m in JobType} | {m.value: m for m in JobType}
+_PRIORITY_MAP = {m.name: m for m in JobPriority} | {m.value: m for m in JobPriority}
 
-def create_test_jobs(db: Session, jobs: List[Dict], fail_on_error=True) -> Dict[str, str]:
+_DEFAULT_RESOURCES = {"cpu_units": 1, "memory_mb": 128}
+
+# A job definition with every field resolved; tests may pass these or plain dicts
+_JobSpec = namedtuple(
+    "JobSpec",
+    "job_id type priority payload resource_requirements depends_on retry_config timeout_seconds",
+    defaults=(None, JobType.email, JobPriority.normal, {}, _DEFAULT_RESOURCES, (), None, None),
+)
+
+def _coerce(job_data) -> _JobSpec:
     """
-    Create multiple test jobs based on provided job definitions and return a mapping of original IDs to created job IDs.
-    If fail_on_error is True, fail the test on error; otherwise, raise the exception for caller handling.
+    Normalize a job definition dict into a _JobSpec, applying the defaults once.
+    """
+    if isinstance(job_data, _JobSpec):
+        return job_data
+    get = job_data.get
+    return _JobSpec(
+        get("job_id"),
+        _JOB_TYPE_MAP.get(get("type", "email"), JobType.email),
+        _PRIORITY_MAP.get(get("priority", "normal"), JobPriority.normal),
+        get("payload", {}),
+        get("resource_requirements", _DEFAULT_RESOURCES),
+        get("depends_on", ()),
+        get("retry_config"),
+        get("timeout_seconds"),
+    )
+
+def _topological_order(specs: List[_JobSpec]) -> List[int]:
     """
-    import uuid
-    created_jobs = {}
-    for index, job_data in enumerate(jobs):
-        job_id = job_data.get("job_id", f"job_{index}_{uuid.uuid4().hex[:8]}")
-        job_type_str = job_data.get("type", "email")
-        try:
-            job_type = JobType(job_type_str) if job_type_str in JobType.__members__ else JobType.email
-        except ValueError:
-            job_type = JobType.email
-        
-        priority_str = job_data.get("priority", "normal")
-        try:
-            priority = JobPriority(priority_str) if priority_str in JobPriority.__members__ else JobPriority.normal
-        except ValueError:
-            priority = JobPriority.normal
-            
-        payload = job_data.get("payload", {})
-        resource_req = job_data.get("resource_requirements", {"cpu_units": 1, "memory_mb": 128})
-        depends_on = job_data.get("depends_on", [])
-        retry_config_data = job_data.get("retry_config")
-        retry_config = RetryConfig(**retry_config_data) if retry_config_data else None
-        timeout_seconds = job_data.get("timeout_seconds")
+    Return the indices of the job definitions ordered so every job follows the jobs it depends on (Kahn's algorithm).
+    Raises ValueError if a dependency is not defined in the batch or the
+    definitions contain a dependency cycle.
+    """
+    keys = [index if spec.job_id is None else spec.job_id for index, spec in enumerate(specs)]
+    position = {key: index for index, key in enumerate(keys)}
+    indegree = [0] * len(specs)
+    dependents = [[] for _ in specs]
+    for index, spec in enumerate(specs):
+        for dep in spec.depends_on:
+            dep_index = position.get(dep)
+            if dep_index is None:
+                raise ValueError(f"Dependency {dep} not found in job definitions")
+            indegree[index] += 1
+            dependents[dep_index].append(index)
+
+    ready = deque(index for index, degree in enumerate(indegree) if degree == 0)
+    order = []
+    while ready:
+        index = ready.popleft()
+        order.append(index)
+        for dependent in dependents[index]:
+            indegree[dependent] -= 1
+            if indegree[dependent] == 0:
+                ready.append(dependent)
+
+    if len(order) < len(specs):
+        cyclic = [keys[index] for index, degree in enumerate(indegree) if degree]
+        raise ValueError(f"Dependency cycle detected among jobs: {cyclic}")
+    return order
 
-        job_create = JobCreate(
-            type=job_type,
-            priority=priority,
-            payload=payload,
-            resource_requirements=ResourceRequirements(**resource_req),
-            depends_on=[created_jobs.get(dep, dep) for dep in depends_on],
-            retry_config=retry_config,
-            timeout_seconds=timeout_seconds
+def create_test_jobs(db: Session, jobs: Iterable, fail_on_error=True) -> Dict[str, str]:
+    """
+    Create multiple test jobs based on provided job definitions (dicts or _JobSpec) and return a mapping of original IDs to created job IDs.
+    All jobs are inserted as one batch in dependency order; cycles are rejected before touching the DB.
+    The returned mapping follows the order of the definitions as given.
+    If fail_on_error is True, fail the test on error; otherwise, raise the exception for caller handling.
+    """
+    specs = [_coerce(job_data) for job_data in jobs]
+    try:
+        order = _topological_order(specs)
+    except ValueError as e:
+        if fail_on_error:
+            pytest.fail(str(e))
+        raise
+    # One urandom call supplies the 8 hex chars of every new job ID
+    id_hex = os.urandom(4 * len(specs)).hex()
+    new_ids = [f"job_{id_hex[index * 8:(index + 1) * 8]}" for index in range(len(specs))]
+    created_jobs = {
+        new_job_id if spec.job_id is None else spec.job_id: new_job_id
+        for spec, new_job_id in zip(specs, new_ids)
+    }
+    # _topological_order has checked that every dependency is a key of created_jobs
+    getter = created_jobs.__getitem__
+    job_ids = [new_ids[index] for index in order]
+    job_creates = [
+        JobCreate(
+            type=spec.type,
+            priority=spec.priority,
+            payload=spec.payload,
+            resource_requirements=ResourceRequirements(**spec.resource_requirements),
+            depends_on=list(map(getter, spec.depends_on)),
+            retry_config=RetryConfig(**spec.retry_config) if spec.retry_config else None,
+            timeout_seconds=spec.timeout_seconds
         )
-        # Temporarily set job_type to match the expected attribute in job_service
-        job_create.__dict__['job_type'] = job_create.type
-        
-        try:
-            job = create_job(db, job_create)
-            created_jobs[job_id] = job.job_id
-        except Exception as e:
-            if fail_on_error:
-                pytest.fail(f"Error creating job {job_id}: {str(e)}")
-            else:
-                raise
-    
+        for spec in (specs[index] for index in order)
+    ]
+
+    try:
+        create_jobs(db, job_creates, job_ids)
+    except Exception as e:
+        if fail_on_error:
+            pytest.fail(f"Error creating jobs: {str(e)}")
+        else:
+            raise
+
     return created_jobs
 
 def test_scenario_1_basic_job_flow(db_session):
@@ -91,8 +149,9 @@ def test_scenario_1_basic_job_flow(db_session):
     created_jobs = create_test_jobs(db_session, test_jobs, fail_on_error=True)
     assert len(created_jobs) == 3, "All jobs should be created successfully"
     
-    # Verify job priority is set correctly
-    critical_job_id = [job_id for orig_id, job_id in created_jobs.items() if test_jobs[[i for i, d in enumerate(test_jobs) if d.get("priority") == "critical"][0]]["payload"]["to"] in get_job(db_session, job_id).payload.values()][0]
+    # Verify job priority is set correctly; created_jobs follows the order of test_jobs
+    critical_index = next(i for i, d in enumerate(test_jobs) if d["priority"] == "critical")
+    critical_job_id = list(created_jobs.values())[critical_index]
     critical_job = get_job(db_session, critical_job_id)
     assert critical_job.priority == JobPriority.critical, "Critical job should have critical priority set"
 
@@ -272,6 +331,69 @@ def test_scenario_5_failure_and_recovery(db_session):
     assert len(dependent_job.depends_on) == 1, "Dependent job should depend on unreliable job"
     assert dependent_job.depends_on[0].job_id == unreliable_job_id, "Dependent job should depend on unreliable job"
 
+def test_cancel_job(db_session):
+    """
+    Test cancelling a pending job.
+    Expected Behavior: The job becomes cancelled, cannot be cancelled twice, and unknown jobs return None.
+    """
+    created_jobs = create_test_jobs(db_session, [
+        {"job_id": "cancel_me", "payload": {"to": "cancel@example.com"}}
+    ])
+
+    job = cancel_job(db_session, created_jobs["cancel_me"])
+    assert job.status == JobStatus.cancelled, "Cancelled job should be in cancelled state"
+    with pytest.raises(ValueError):
+        cancel_job(db_session, created_jobs["cancel_me"])
+    assert cancel_job(db_session, "job_missing") is None, "Unknown job should not be cancellable"
+
+def test_claim_and_execute_job(db_session):
+    """
+    Test the worker path for one job: claim it, run it with a stub perform, and complete it.
+    Expected Behavior: Resources are reserved while the job runs and released on completion, and a claimed job cannot be claimed again.
+    """
+    payload = {"to": "run@example.com"}
+    created_jobs = create_test_jobs(db_session, [
+        {"job_id": "run_me", "payload": payload, "resource_requirements": {"cpu_units": 2, "memory_mb": 256}}
+    ])
+    job = get_job(db_session, created_jobs["run_me"])
+    pool = db_session.get(ResourcePool, RESOURCE_POOL_ID)
+    used_cpu, used_memory = pool.used_cpu_units, pool.used_memory_mb
+
+    assert claim_job(db_session, job), "Pending job should be claimed"
+    assert not claim_job(db_session, job), "A claimed job should not be claimed twice"
+    db_session.refresh(pool)
+    assert (pool.used_cpu_units, pool.used_memory_mb) == (used_cpu + 2, used_memory + 256), "Claim should reserve resources"
+
+    performed = []
+    assert execute_job(db_session, job, perform=lambda job_type, job_payload: performed.append(job_payload))
+    assert performed == [payload], "perform should be called once with the job payload"
+
+    db_session.refresh(job)
+    db_session.refresh(pool)
+    assert job.status == JobStatus.completed, "Executed job should be completed"
+    assert (pool.used_cpu_units, pool.used_memory_mb) == (used_cpu, used_memory), "Completion should release resources"
+
+def test_recover_orphaned_jobs(db_session):
+    """
+    Test worker start-up recovery after a worker died holding reservations.
+    Expected Behavior: Jobs it left running go back to pending and the pool's leftover usage is rebuilt from the jobs still running.
+    """
+    created_jobs = create_test_jobs(db_session, [
+        {"job_id": "orphan", "payload": {"to": "orphan@example.com"}, "resource_requirements": {"cpu_units": 2, "memory_mb": 256}}
+    ])
+    job = get_job(db_session, created_jobs["orphan"])
+    assert claim_job(db_session, job), "Pending job should be claimed"
+    pool = db_session.get(ResourcePool, RESOURCE_POOL_ID)
+    pool.used_cpu_units += 3  # capacity leaked by an earlier crash
+    pool.used_memory_mb += 512
+    db_session.commit()
+
+    assert recover_orphaned_jobs(db_session) >= 1, "The orphaned job should be requeued"
+    db_session.refresh(job)
+    db_session.refresh(pool)
+    assert job.status == JobStatus.pending, "Orphaned job should be pending again"
+    assert (pool.used_cpu_units, pool.used_memory_mb) == (0, 0), "No running jobs remain, so nothing should be reserved"
+
 def test_bonus_scenario_circular_dependencies(db_session):
     """
     Test handling of circular dependencies in job graphs.
@@ -283,51 +405,56 @@ def test_bonus_scenario_circular_dependencies(db_session):
         {"job_id": "job_c", "depends_on": ["job_b"]}
     ]
     
-    try:
+    jobs_before = count_jobs(db_session)
+    with pytest.raises(ValueError, match="cycle"):
         create_test_jobs(db_session, circular_deps, fail_on_error=False)
-        # If no exception is raised, check if jobs were created (they shouldn't be due to circular dependency)
-        assert False, "Circular dependency should have raised an error or prevented job creation"
-    except Exception as e:
-        assert True, "Circular dependency error was raised as expected"
+    assert count_jobs(db_session) == jobs_before, "No jobs should be inserted when a cycle is rejected"
 
-def test_performance_submit_1000_jobs(db_session):
+@pytest.mark.parametrize("n", [100, 1000, 5000], ids=lambda n: f"n={n}")
+def test_performance_submit_jobs(db_session, n):
     """
-    Performance test to submit 1000 jobs with various priorities.
+    Performance test to submit n jobs with various priorities.
     Description: Measure time to accept all submissions, queue operation performance, memory usage growth, and query performance as queue grows.
     Note: Full performance metrics (time, memory usage) may require external monitoring tools. This test focuses on job creation.
     """
     import time
     import random
     
-    priorities = ["low", "normal", "high", "critical"]
-    job_types = ["email", "data_export", "report_generation"]
-    
-    # Generate 1000 jobs
-    performance_jobs = []
-    for i in range(1000):
-        priority = random.choice(priorities)
-        job_type = random.choice(job_types)
-        cpu_units = random.randint(1, 4)
-        memory_mb = random.randint(128, 2048)
-        performance_jobs.append({
-            "job_id": f"perf_job_{i:04d}",
-            "type": job_type,
-            "priority": priority,
-            "payload": {"task": f"task_{i}"},
-            "resource_requirements": {"cpu_units": cpu_units, "memory_mb": memory_mb}
-        })
+    priorities = [JobPriority.low, JobPriority.normal, JobPriority.high, JobPriority.critical]
+    job_types = [JobType.email, JobType.data_export, JobType.report_generation]
     
+    # Draw each column from one seeded RNG in a single call; the enum columns
+    # are references to the shared members, so no per-job strings are created
+    rng = random.Random(0)
+    prios = rng.choices(priorities, k=n)
+    types = rng.choices(job_types, k=n)
+    cpus = rng.choices(range(1, 5), k=n)
+    mems = rng.choices(range(128, 2049), k=n)
+
+    # Already-resolved specs skip _coerce's dict lookups. They are built as a list
+    # because create_test_jobs sorts the whole batch topologically and create_jobs
+    # inserts it in one transaction, so a generator would be materialized anyway
+    specs = [
+        _JobSpec(
+            job_id=f"perf_job_{i:04d}",
+            type=t,
+            priority=p,
+            payload={"task": f"task_{i}"},
+            resource_requirements={"cpu_units": c, "memory_mb": m},
+        )
+        for i, (t, p, c, m) in enumerate(zip(types, prios, cpus, mems))
+    ]
+
     start_time = time.time()
-    created_jobs = create_test_jobs(db_session, performance_jobs, fail_on_error=True)
+    created_jobs = create_test_jobs(db_session, specs, fail_on_error=True)
     end_time = time.time()
     
-    assert len(created_jobs) == 1000, "All 1000 performance test jobs should be created successfully"
-    print(f"\nTime to submit 1000 jobs: {end_time - start_time:.2f} seconds")
+    assert len(created_jobs) == n, f"All {n} performance test jobs should be created successfully"
+    print(f"\nTime to submit {n} jobs: {end_time - start_time:.2f} seconds")
     
     # Basic query performance check
     start_query_time = time.time()
-    pending_jobs = list_jobs(db_session, status=JobStatus.pending)
-    print("✅✅✅✅✅", pending_jobs)
+    pending_count = count_jobs(db_session, status=JobStatus.pending)
     end_query_time = time.time()
-    print(f"Time to query pending jobs after 1000 submissions: {end_query_time - start_query_time:.2f} seconds")
-    assert len(created_jobs) == 1000, "All 1000 performance test jobs should have been created"
+    print(f"Time to query pending jobs after {n} submissions: {end_query_time - start_query_time:.2f} seconds")
+    assert pending_count >= n, f"All {n} performance test jobs should be pending"
@@ -0,0 +1,27 @@
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+from app.models.job import JobPriority
+from app.workers.worker import ReadyQueue
+
+def _pending(job_id: str, priority: JobPriority, created_at: datetime):
+    # Same key columns as a get_pending_jobs row
+    return SimpleNamespace(job_id=job_id, priority=priority, created_at=created_at)
+
+def test_ready_queue_pops_by_priority_then_age():
+    """
+    Test the worker's ready queue ordering.
+    Expected Behavior: Jobs pop most urgent first, oldest first within a priority, and re-pushing a queued job is a no-op.
+    """
+    now = datetime(2024, 1, 15, 12, 0, 0)
+    ready = ReadyQueue()
+    ready.push(_pending("low_old", JobPriority.low, now - timedelta(hours=1)))
+    ready.push(_pending("normal_new", JobPriority.normal, now))
+    ready.push(_pending("critical", JobPriority.critical, now))
+    ready.push(_pending("normal_old", JobPriority.normal, now - timedelta(microseconds=1)))
+    ready.push(_pending("critical", JobPriority.critical, now))
+
+    assert len(ready) == 4, "Re-pushing a queued job should not add a second entry"
+    assert [ready.pop() for _ in range(len(ready))] == ["critical", "normal_old", "normal_new", "low_old"]
+
+    ready.push(_pending("critical", JobPriority.critical, now))
+    assert len(ready) == 1, "A popped job can be queued again"
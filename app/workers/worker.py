@@ -1,58 +1,293 @@
+import heapq
+import os
+import queue
+import select
 import time
-from sqlalchemy.orm import Session
-from app.services.database import SessionLocal
-from app.models.job import Job, JobStatus
-from app.services.job_service import can_execute_job, execute_job
+from datetime import datetime, timedelta
+from typing import List, Set, Tuple
+import psycopg2
+import psycopg2.extensions
+from sqlalchemy import Integer, bindparam, literal, select as sa_select, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.orm import aliased
+from app.services.database import DATABASE_URL, SessionLocal, engine
+from app.models.job import Job, JobStatus, job_dependencies
+from app.services.job_service import NEW_JOB_CHANNEL, recover_orphaned_jobs
+from app.services.log_writer import log_writer
+from app.services.scheduler import Scheduler
 
 import logging
+from logging.handlers import QueueHandler, QueueListener
 logging.getLogger('sqlalchemy.engine').setLevel(logging.WARN)
 
-def get_pending_jobs(db: Session):
+log = logging.getLogger("worker")
+
+# Pending jobs fetched per refill of the ready queue
+PENDING_BATCH_SIZE = 100
+
+# Every live worker holds this advisory lock in shared mode; taking it
+# exclusively proves no other worker is running
+WORKER_LOCK_KEY = 0x6A6F6273
+
+# Cap on the idle wait between pending scans; the wait doubles while the queue stays empty
+MAX_IDLE_WAIT_SECONDS = 60
+
+# A pending job is blocked while any of its dependencies is not completed
+_Parent = aliased(Job)
+_HAS_OPEN_DEPENDENCY = (
+    sa_select(literal(1))
+    .select_from(job_dependencies.join(_Parent, _Parent.job_id == job_dependencies.c.depends_on_id))
+    .where(job_dependencies.c.job_id == Job.job_id, _Parent.status != JobStatus.completed)
+    .exists()
+)
+
+# Built once at import; the engine's compiled cache then serves every poll.
+# Only the ready-queue key columns are read; the dispatch pass loads full rows.
+# Blocked jobs are left out so they can never crowd their own parents out of
+# the LIMIT window.
+_PENDING_STMT = (
+    sa_select(Job.job_id, Job.priority, Job.created_at)
+    .where(Job.status == JobStatus.pending, ~_HAS_OPEN_DEPENDENCY)
+    .order_by(Job.priority.asc(), Job.created_at.asc())
+    .limit(bindparam("limit", type_=Integer))
+)
+
+def get_pending_jobs(conn: Connection, limit: int = PENDING_BATCH_SIZE):
     """
-    Retrieve pending jobs ordered by priority and creation time.
+    Retrieve the next `limit` pending jobs whose dependencies have all completed,
+    ordered by priority and creation time, as (job_id, priority, created_at) rows.
     """
-    return (
-        db.query(Job)
-        .filter(Job.status == JobStatus.pending)
-        .order_by(Job.priority.asc(), Job.created_at.asc())
-        .all()
-    )
+    return conn.execute(_PENDING_STMT, {"limit": limit}).all()
 
-def run_worker(poll_interval_idle: int = 5, poll_interval_active: int = 1):
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+class ReadyQueue:
     """
-    Main worker loop to process jobs.
+    Min-heap of pending job ids keyed by (priority rank, created_at), so the
+    most urgent job is popped first in O(log n). created_at is kept as integer
+    microseconds since the epoch, so every key compare is on native ints and str.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, int, str]] = []
+        self._queued: Set[str] = set()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, job: Job):
+        # Accepts a Job or a get_pending_jobs row; both expose the key columns
+        if job.job_id in self._queued:
+            return
+        self._queued.add(job.job_id)
+        created_us = (job.created_at - _EPOCH) // _MICROSECOND
+        heapq.heappush(self._heap, (job.priority.rank, created_us, job.job_id))
+
+    def pop(self) -> str:
+        _, _, job_id = heapq.heappop(self._heap)
+        self._queued.discard(job_id)
+        return job_id
+
+class NewJobListener:
     """
-    print("🚀 Starting job worker...")
+    Blocks on a dedicated LISTEN connection until a NOTIFY arrives on
+    NEW_JOB_CHANNEL or the timeout expires. If the connection cannot be
+    opened or is lost, wait() degrades to a plain timed sleep and reconnects
+    on the next call.
+    """
+
+    def __init__(self, dsn: str = DATABASE_URL):
+        self._dsn = dsn
+        self._conn = None
+
+    def _connect(self):
+        if self._conn is None:
+            try:
+                self._conn = psycopg2.connect(self._dsn)
+                self._conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with self._conn.cursor() as cursor:
+                    cursor.execute(f"LISTEN {NEW_JOB_CHANNEL}")
+            except psycopg2.Error as e:
+                log.warning("Job listener unavailable, polling instead: %s", e)
+                self.close()
+        return self._conn
 
-    while True:
-        db = SessionLocal()
+    def wait(self, timeout: float) -> bool:
+        """
+        Return True if new jobs were announced before the timeout.
+        """
+        conn = self._connect()
+        if conn is None:
+            time.sleep(timeout)
+            return False
         try:
-            pending_jobs = get_pending_jobs(db)
-
-            if not pending_jobs:
-                print("🟡 No pending jobs. Sleeping...")
-                time.sleep(poll_interval_idle)
-                continue
-
-            for job in pending_jobs:
-                try:
-                    if can_execute_job(db, job):
-                        print(f"Executing job {job.job_id} (Priority: {job.priority})")
-                        success = execute_job(db, job)
-                        print(f"Job {job.job_id} {'completed' if success else 'failed'}")
-                    else:
-                        print(f"⏳ Job {job.job_id} is not ready (dependencies/resources)")
-                except Exception as job_error:
-                    print(f"Error processing job {job.job_id}: {job_error}")
-
-            time.sleep(poll_interval_active)
-
-        except Exception as loop_error:
-            print(f"Worker loop error: {loop_error}")
-            time.sleep(10)  # Backoff on failure
+            if conn.notifies or select.select([conn], [], [], timeout)[0]:
+                conn.poll()
+                notified = bool(conn.notifies)
+                conn.notifies.clear()
+                return notified
+        except (psycopg2.Error, OSError) as e:
+            log.warning("Job listener error: %s", e)
+            self.close()
+        return False
 
+    def close(self):
+        if self._conn is not None:
+            try:
+                self._conn.close()
+            except psycopg2.Error:
+                pass
+            self._conn = None
+
+def _register_worker() -> Connection:
+    """
+    Hold the worker lock in shared mode for this worker's lifetime. If no other
+    worker is live, first take it exclusively and recover the jobs and pool
+    capacity left behind by workers that stopped without finishing their jobs.
+    """
+    conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+    params = {"key": WORKER_LOCK_KEY}
+    if conn.scalar(text("SELECT pg_try_advisory_lock(:key)"), params):
+        try:
+            with SessionLocal() as db:
+                requeued = recover_orphaned_jobs(db)
+            if requeued:
+                log.warning("Requeued %d jobs left running by a stopped worker", requeued)
         finally:
-            db.close()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), params)
+    conn.execute(text("SELECT pg_advisory_lock_shared(:key)"), params)
+    return conn
+
+def _start_log_listener() -> QueueListener:
+    """
+    Route all log records through a queue so formatting and stream writes
+    happen on the listener's thread instead of the dispatch loop and job threads.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    root = logging.getLogger()
+    root.addHandler(QueueHandler(log_queue))
+    root.setLevel(os.getenv("WORKER_LOG_LEVEL", "INFO").upper())
+    listener = QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+def run_worker(poll_interval_idle: int = 5, poll_interval_active: int = 1):
+    """
+    Main worker loop to process jobs.
+
+    Jobs are dispatched from an in-process ReadyQueue. The database is only
+    queried for more work (a bounded, indexed LIMIT query) once the queue is
+    empty, after a pass that could not start anything, or when a NOTIFY on
+    NEW_JOB_CHANNEL announces newly committed jobs. Between passes the worker
+    blocks on the LISTEN socket instead of sleeping. One Session (for
+    dispatching) and one AUTOCOMMIT connection (for the pending scan) are kept
+    for the worker's lifetime, so the scan never leaves a transaction open.
+
+    Several worker processes can run side by side: each claims a job with a
+    single status-guarded UPDATE (claim_job), which skips a row another worker
+    is claiming at that moment rather than waiting on it.
+    """
+    log_listener = _start_log_listener()
+    log.info("🚀 Starting job worker...")
+    worker_lock = _register_worker()
+    scheduler = Scheduler()
+    # Every running job briefly needs a connection for its bookkeeping, on top of
+    # the worker lock, the dispatcher session, the scan connection and the log writer
+    connections_needed = scheduler.max_running + 4
+    if engine.pool.size() < connections_needed:
+        log.warning("DB_POOL_SIZE=%d is below the %d connections this worker can use at once; "
+                    "job threads may wait up to pool_timeout", engine.pool.size(), connections_needed)
+    log_writer.start()
+    ready = ReadyQueue()
+    listener = NewJobListener()
+    # Pending jobs are a snapshot for each pass; resource reservations
+    # commit mid-pass and must not expire the rest of them
+    db = SessionLocal(expire_on_commit=False)
+    scan_conn = None
+    refill = True
+    idle_mult = 1
+
+    try:
+        while True:
+            try:
+                if refill or not ready:
+                    if scan_conn is None:
+                        scan_conn = engine.connect().execution_options(isolation_level="AUTOCOMMIT")
+                    for row in get_pending_jobs(scan_conn):
+                        ready.push(row)
+                    refill = False
+
+                if not ready:
+                    # NOTIFY wakes the worker immediately; the backoff only bounds
+                    # the fallback rescans of a quiet queue
+                    idle_wait = min(poll_interval_idle * idle_mult, MAX_IDLE_WAIT_SECONDS)
+                    log.debug("🟡 No pending jobs. Waiting up to %ss...", idle_wait)
+                    refill = listener.wait(idle_wait)
+                    idle_mult = 1 if refill else min(idle_mult * 2, 12)
+                    continue
+
+                idle_mult = 1
+
+                job_ids = [ready.pop() for _ in range(len(ready))]
+                # Re-read the batch in one query to drop jobs cancelled or started since
+                # they were queued; claim_job settles any race with other workers
+                jobs = {
+                    job.job_id: job
+                    for job in db.query(Job)
+                    .filter(Job.job_id.in_(job_ids), Job.status == JobStatus.pending)
+                    .populate_existing()
+                }
+
+                started = 0
+                deferred = []
+                for job_id in job_ids:
+                    job = jobs.get(job_id)
+                    if job is None or scheduler.is_inflight(job_id):
+                        continue
+                    try:
+                        if scheduler.submit(db, job):
+                            started += 1
+                            log.info("Executing job %s (Priority: %s)", job.job_id, job.priority)
+                        else:
+                            deferred.append(job)
+                            log.debug("⏳ Job %s is not ready (dependencies/resources/concurrency)", job.job_id)
+                    except Exception as job_error:
+                        db.rollback()
+                        log.error("Error processing job %s: %s", job.job_id, job_error)
+
+                # Keep waiting jobs queued while the batch is making progress; a pass
+                # that starts nothing drops them so the next pass re-reads the queue
+                if started:
+                    for job in deferred:
+                        ready.push(job)
+
+                db.commit()
+                # Drop this pass's snapshot so the long-lived session doesn't grow
+                db.expunge_all()
+                refill = listener.wait(poll_interval_active)
+
+            except Exception as loop_error:
+                db.rollback()
+                db.expunge_all()
+                # Reconnect the scan connection next pass in case it was the one that broke
+                if scan_conn is not None:
+                    scan_conn.invalidate()
+                    scan_conn.close()
+                    scan_conn = None
+                log.exception("Worker loop error: %s", loop_error)
+                time.sleep(10)  # Backoff on failure
+    finally:
+        listener.close()
+        if scan_conn is not None:
+            scan_conn.close()
+        db.close()
+        scheduler.shutdown()  # let in-flight jobs finish
+        log_writer.stop()  # flush buffered job log lines before exiting
+        worker_lock.close()
+        log_listener.stop()
 
 if __name__ == "__main__":
     run_worker()